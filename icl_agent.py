@@ -1,35 +1,163 @@
 import yaml
-from pypdf import PdfReader
 import google.generativeai as genai
 import os
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
 import re
+import hashlib
+import asyncio
+import concurrent.futures
+import functools
+import sqlite3
+import tempfile
+from pathlib import Path
+from diskcache import Cache
 from dotenv import load_dotenv
 
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+if TYPE_CHECKING:
+    from pypdf import PdfReader
+
+# Markdown fences and YAML comments, stripped from model output in a single pass.
+_NOISE_RE = re.compile(r'```[yamlYAML]*\n?|#.*$', re.MULTILINE)
+
+@functools.lru_cache(maxsize=1)
+def _response_cache() -> Optional[Cache]:
+    """Opens the on-disk response cache on first use; None if the code directory is not writable."""
+    try:
+        return Cache(str(Path(__file__).parent / ".gemini_cache"))
+    except (OSError, sqlite3.Error):
+        return None
+
+class ErrorResult(dict):
+    """Error dict returned in place of a config; its own type so configs with an `error` key aren't mistaken for failures."""
+
+SafeDumper.add_representer(ErrorResult, SafeDumper.represent_dict)
+
+def is_error(config) -> bool:
+    """Whether a result is one of the agents' error dicts rather than a generated config."""
+    return isinstance(config, ErrorResult)
+
+def _empty_knowledge() -> Dict:
+    """Knowledge skeleton used before, or instead of, extracted documentation."""
+    return {
+        "schema": {"components": [], "parameters": []},
+        "rules": {"validation": [], "security": []},
+        "practices": {"deployment": [], "configuration": []},
+        "patterns": {"common": [], "recommended": []}
+    }
+
+def _open_pdf(path: str) -> "PdfReader":
+    """Opens a PDF; pypdf is imported lazily to keep it off the Streamlit import path."""
+    from pypdf import PdfReader
+    return PdfReader(path)
+
+# Reader opened by _init_pdf_worker in each extraction worker process.
+_worker_pdf: Optional["PdfReader"] = None
+
+def _init_pdf_worker(path: str) -> None:
+    """Opens the PDF once in each extraction worker process."""
+    global _worker_pdf
+    _worker_pdf = _open_pdf(path)
+
+def _extract_page(index: int) -> str:
+    """Extracts the text of a single PDF page; runs in a worker process."""
+    return _worker_pdf.pages[index].extract_text() or ""
+
+# Knowledge extraction sends the documentation in batches of roughly this many tokens,
+# estimated from character counts to avoid a count_tokens round-trip per page.
+_KB_BATCH_TOKENS = 6000
+_CHARS_PER_TOKEN = 4
+# Upper bound on concurrent extraction calls, to stay clear of API rate limits.
+_KB_MAX_CONCURRENCY = 4
+
+def _batch_pages(texts: List[str], max_tokens: int = _KB_BATCH_TOKENS) -> List[str]:
+    """Groups consecutive page texts into batches of roughly max_tokens tokens."""
+    batches, current, size = [], [], 0
+    for text in texts:
+        tokens = len(text) // _CHARS_PER_TOKEN
+        if current and size + tokens > max_tokens:
+            batches.append("\n".join(current))
+            current, size = [], 0
+        current.append(text)
+        size += tokens
+    if current:
+        batches.append("\n".join(current))
+    return batches
+
+def _merge_knowledge(parts: List[Dict]) -> Dict:
+    """Unions the list fields of per-batch knowledge, dropping duplicate entries."""
+    merged = {}
+    for part in parts:
+        for category, fields in part.items():
+            if not isinstance(fields, dict):
+                continue
+            target = merged.setdefault(category, {})
+            for field, items in fields.items():
+                if items is None:
+                    continue
+                target.setdefault(field, []).extend(items if isinstance(items, list) else [items])
+    for fields in merged.values():
+        for field, items in fields.items():
+            fields[field] = list({repr(item): item for item in items}.values())
+    return merged
+
+def _run_coroutine(coro):
+    """Runs a coroutine to completion, on a worker thread if this thread already has a running event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
 load_dotenv()
 
-class ICLAgent:
-    def __init__(self, doc_path: str, api_key: str, output_dir: str = "configs"):
-        """Initialize the ICL Agent with necessary configurations."""
-        self.doc_path = doc_path
-        self.output_dir = output_dir
-        self.knowledge = {}
-        
-        os.makedirs(output_dir, exist_ok=True)  
+class BaseICLAgent:
+    """Prompt building, generation and response parsing shared by the CLI and Streamlit agents."""
 
-        
-        genai.configure(api_key=api_key)
-        generation_config = {
-            "temperature": 0.1,  
-            "top_p": 0.8,
-            "top_k": 40,
-        }
-        self.model = genai.GenerativeModel('gemini-1.5-flash', generation_config=generation_config)
-        
-       
-        self.log("Initializing and loading documentation...")
-        self._load_knowledge()
+    model_name = 'gemini-1.5-flash'
+    generation_config = {
+        "temperature": 0.1,
+        "top_p": 0.8,
+        "top_k": 40,
+    }
+
+    def __init__(self, model: genai.GenerativeModel):
+        """Initialize shared agent state around an already-built Gemini model."""
+        self.model = model
+        self.knowledge = _empty_knowledge()
+
+    @classmethod
+    def build_model(cls) -> genai.GenerativeModel:
+        """Creates the Gemini model; genai must already be configured with an API key."""
+        return genai.GenerativeModel(cls.model_name, generation_config=cls.generation_config)
+
+    @classmethod
+    def _response_key(cls, prompt: str) -> str:
+        """Stable cache key for a prompt under this agent's model and generation settings."""
+        material = f"{cls.model_name}\n{sorted(cls.generation_config.items())!r}\n{prompt}"
+        return hashlib.blake2b(material.encode(), digest_size=16).hexdigest()
+
+    @property
+    def knowledge(self) -> Dict:
+        return self._knowledge
+
+    @knowledge.setter
+    def knowledge(self, value: Dict) -> None:
+        self._knowledge = value
+        self._knowledge_yaml_cache = None
+
+    @property
+    def _knowledge_yaml(self) -> str:
+        """Serialized knowledge base, recomputed only when `knowledge` is reassigned."""
+        if self._knowledge_yaml_cache is None:
+            self._knowledge_yaml_cache = yaml.dump(self._knowledge, default_flow_style=False, Dumper=SafeDumper)
+        return self._knowledge_yaml_cache
 
     def log(self, message: str, type: str = "info") -> None:
         """Unified logging with emoji indicators."""
@@ -43,34 +171,107 @@ class ICLAgent:
         prefix = indicators.get(type, "ℹ️")
         print(f"{prefix} {message}")
 
+    def _cached_response(self, prompt: str) -> Optional[str]:
+        """Returns a previously cached response for the prompt, if any."""
+        cache = _response_cache()
+        return cache.get(self._response_key(prompt)) if cache is not None else None
+
+    def _generate(self, prompt: str) -> str:
+        """Returns the model response text, served from the response cache on repeats."""
+        text = self._cached_response(prompt)
+        if text is None:
+            text = self.model.generate_content(prompt).text
+        return text
+
+    async def _generate_async(self, prompt: str, on_chunk: Optional[Callable[[str], None]] = None) -> str:
+        """Streams the model response, passing each chunk to on_chunk; callers check the response cache first."""
+        text = ""
+        async for chunk in await self.model.generate_content_async(prompt, stream=True):
+            text += chunk.text
+            if on_chunk:
+                on_chunk(chunk.text)
+        return text
+
+    def _remember_response(self, prompt: str, text: str, config) -> None:
+        """Caches a response only once it parsed, so retrying bad output reaches the model again."""
+        cache = _response_cache()
+        if cache is not None and not is_error(config):
+            cache.add(self._response_key(prompt), text)
+
     def _clean_response(self, text: str) -> str:
         """Cleans model response to ensure valid YAML formatting."""
         if not text:
             return ""
-        
-       
-        text = re.sub(r'```[yamlYAML]*\n', '', text)  # Remove opening ```
-        text = text.replace('```', '')  # Remove closing ```
-        
-      
-        text = re.sub(r'#.*$', '', text, flags=re.MULTILINE)
-        
-       
-        lines = text.strip().splitlines()
-        cleaned_lines = [line.replace('\t', '  ') for line in lines if line.strip()]
-        
-        return '\n'.join(cleaned_lines)
+        text = _NOISE_RE.sub('', text)
+        return '\n'.join(line.replace('\t', '  ') for line in text.strip().splitlines() if line.strip())
 
     def _parse_yaml_safely(self, content: str) -> Dict:
         """Safely parses YAML content, handling multiple documents properly."""
         try:
-            docs = list(yaml.safe_load_all(content))  
+            if not content.strip():
+                raise ValueError("Empty YAML content")
+            if "\n---" not in content:
+                try:
+                    return yaml.load(content, Loader=SafeLoader)
+                except yaml.composer.ComposerError:
+                    pass  # More than one document, e.g. separated by "..." end markers
+            docs = list(yaml.load_all(content, Loader=SafeLoader))  
             if not docs:
                 raise ValueError("Empty YAML content")
             return docs[0] if len(docs) == 1 else {"documents": docs}  
         except yaml.YAMLError as e:
             self.log(f"YAML parsing failed: {str(e)}", "error")
-            return {"error": "Failed to parse YAML", "timestamp": str(datetime.now())}
+            return ErrorResult(error="Failed to parse YAML", timestamp=str(datetime.now()))
+
+    def _has_knowledge(self) -> bool:
+        """Whether any knowledge category holds entries worth sending to the model."""
+        return any(
+            fields if not isinstance(fields, dict) else any(fields.values())
+            for fields in self.knowledge.values()
+        )
+
+    def _build_prompt(self, user_input: str) -> str:
+        """Builds the configuration generation prompt, leaving out an empty knowledge base."""
+        knowledge_block = f"Knowledge base:\n{self._knowledge_yaml}" if self._has_knowledge() else ""
+        return f"""
+        Generate a YAML configuration based on this request: {user_input}
+
+        {knowledge_block}
+
+        Requirements:
+        - Output **only valid YAML**, without markdown or extra text.
+        - Ensure all necessary components are included.
+        - Follow security and best practices.
+        - Use proper indentation.
+
+        Response must be **pure YAML** with no extra formatting.
+        """
+
+    def _finish(self, prompt: str, text: str) -> Tuple[Dict, str]:
+        """Cleans and parses a model response, caching it once it parsed; returns (config, cleaned YAML)."""
+        cleaned = self._clean_response(text)
+        config = self._parse_yaml_safely(cleaned)
+        self._remember_response(prompt, text, config)
+        return config, cleaned
+
+    def generate_config(self, user_input: str) -> Tuple[Dict, str]:
+        """Generates a configuration, returning it parsed and as cleaned YAML text."""
+        prompt = self._build_prompt(user_input)
+        return self._finish(prompt, self._generate(prompt))
+
+class ICLAgent(BaseICLAgent):
+    def __init__(self, doc_path: str, api_key: str, output_dir: str = "configs"):
+        """Initialize the ICL Agent with necessary configurations."""
+        genai.configure(api_key=api_key)
+        super().__init__(self.build_model())
+        self.doc_path = doc_path
+        self.output_dir = output_dir
+        self._io_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        
+        os.makedirs(output_dir, exist_ok=True)  
+
+        self.log("Initializing and loading documentation...")
+        self._load_knowledge()
 
     def _save_yaml(self, data: Dict, name: str = None) -> str:
         """Saves the YAML content to a file."""
@@ -80,7 +281,7 @@ class ICLAgent:
             filepath = os.path.join(self.output_dir, filename)
             
             with open(filepath, 'w', encoding='utf-8') as f:
-                yaml.dump(data, f, default_flow_style=False, allow_unicode=True, sort_keys=False)
+                yaml.dump(data, f, default_flow_style=False, allow_unicode=True, sort_keys=False, Dumper=SafeDumper)
             
             self.log(f"Configuration saved to {filepath}", "success")
             return filepath
@@ -96,8 +297,23 @@ class ICLAgent:
             if not os.path.exists(self.doc_path):
                 raise FileNotFoundError(f"Documentation file not found: {self.doc_path}")
 
-            reader = PdfReader(self.doc_path)
-            content = "\n".join(page.extract_text() for page in reader.pages if page.extract_text())
+            with open(self.doc_path, 'rb') as f:
+                key = hashlib.sha256(f.read()).hexdigest()[:16]
+            cache_path = os.path.join(self.output_dir, f".kb_{key}.yaml")
+            cached = self._read_knowledge_cache(cache_path)
+            if cached:
+                self.knowledge = cached
+                self.log("Loaded cached documentation knowledge", "success")
+                return
+
+            reader = _open_pdf(self.doc_path)
+            page_count = len(reader.pages)
+            if page_count > 1:
+                with concurrent.futures.ProcessPoolExecutor(initializer=_init_pdf_worker, initargs=(self.doc_path,)) as executor:
+                    texts = list(executor.map(_extract_page, range(page_count)))
+            else:
+                texts = [page.extract_text() or "" for page in reader.pages]
+            batches = _batch_pages([text for text in texts if text])
 
             self.log("Extracting key information...", "think")
 
@@ -119,65 +335,101 @@ class ICLAgent:
             Output **only valid YAML**, without markdown formatting or extra text.
             """
             
-            response = self.model.generate_content([prompt, content])
-            knowledge = self._parse_yaml_safely(self._clean_response(response.text))
+            outputs = _run_coroutine(self._extract_batches(prompt, batches))
+            parts_ok = []
+            for output in outputs:
+                cleaned = self._clean_response(output) if output is not None else ""
+                if not cleaned:
+                    continue
+                try:
+                    part = self._parse_yaml_safely(cleaned)
+                except ValueError as e:
+                    self.log(f"Skipping documentation batch: {str(e)}", "error")
+                    continue
+                if isinstance(part, dict) and not is_error(part):
+                    parts_ok.append(part)
+            knowledge = _merge_knowledge(parts_ok)
 
             if not isinstance(knowledge, dict) or not knowledge:
                 raise ValueError("Invalid knowledge structure")
             
             self.knowledge = knowledge
+            if len(parts_ok) < len(batches):
+                self.log(f"Only {len(parts_ok)} of {len(batches)} documentation batches were extracted; knowledge not cached", "error")
+            else:
+                self._write_knowledge_cache(cache_path, knowledge)
             self.log("Documentation processed successfully", "success")
         except Exception as e:
             self.log(f"Error loading documentation: {str(e)}", "error")
-            self.knowledge = {
-                "schema": {"components": [], "parameters": []},
-                "rules": {"validation": [], "security": []},
-                "practices": {"deployment": [], "configuration": []},
-                "patterns": {"common": [], "recommended": []}
-            }
-
-    def process_request(self, user_input: str) -> Tuple[Dict, str]:
-        """Generates an ICL YAML configuration based on user input."""
+            self.knowledge = _empty_knowledge()
+
+    def _read_knowledge_cache(self, cache_path: str) -> Optional[Dict]:
+        """Returns cached knowledge, or None if the cache is missing, unreadable or malformed."""
+        if not os.path.exists(cache_path):
+            return None
         try:
-            self.log(f"Processing request: {user_input}", "think")
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                knowledge = yaml.load(f, Loader=SafeLoader)
+        except (OSError, yaml.YAMLError) as e:
+            self.log(f"Ignoring unreadable knowledge cache {cache_path}: {str(e)}", "error")
+            return None
+        if not isinstance(knowledge, dict) or not knowledge:
+            self.log(f"Ignoring malformed knowledge cache {cache_path}", "error")
+            return None
+        return knowledge
 
-            prompt = f"""
-            Generate a YAML configuration based on this request: {user_input}
+    def _write_knowledge_cache(self, cache_path: str, knowledge: Dict) -> None:
+        """Writes the knowledge cache atomically so an interrupted run never leaves a partial file."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.output_dir, prefix=".kb_", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                yaml.dump(knowledge, f, default_flow_style=False, allow_unicode=True, sort_keys=False, Dumper=SafeDumper)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
 
-            Knowledge base:
-            {yaml.dump(self.knowledge, default_flow_style=False)}
+    async def _extract_batches(self, prompt: str, batches: List[str]) -> List[Optional[str]]:
+        """Runs the knowledge extraction prompt over all batches with bounded concurrency; failed batches yield None."""
+        semaphore = asyncio.Semaphore(_KB_MAX_CONCURRENCY)
 
-            Requirements:
-            - Output **only valid YAML**, without markdown or extra text.
-            - Ensure all necessary components are included.
-            - Follow security and best practices.
-            - Use proper indentation.
+        async def extract(index: int, batch: str) -> Optional[str]:
+            async with semaphore:
+                try:
+                    response = await self.model.generate_content_async([prompt, batch])
+                    return response.text
+                except Exception as e:
+                    self.log(f"Documentation batch {index + 1}/{len(batches)} failed: {str(e)}", "error")
+                    return None
 
-            Response must be **pure YAML** with no extra formatting.
-            """
-            
-            response = self.model.generate_content(prompt)
-            config = self._parse_yaml_safely(self._clean_response(response.text))
-            filepath = self._save_yaml(config, "icl_config")
+        return await asyncio.gather(*(extract(i, batch) for i, batch in enumerate(batches)))
+
+    def process_request(self, user_input: str) -> Tuple[Dict, concurrent.futures.Future]:
+        """Generates an ICL YAML configuration; the returned future resolves to the saved file path."""
+        try:
+            self.log(f"Processing request: {user_input}", "think")
+
+            config, _ = self.generate_config(user_input)
+            future = self._io_pool.submit(self._save_yaml, config, "icl_config")
 
-            return config, filepath
+            return config, future
         except Exception as e:
             self.log(f"Error processing request: {str(e)}", "error")
             raise
 
-    def update_configuration(self, current_config: Dict, update_request: str) -> Tuple[Dict, str]:
-        """Updates an existing configuration based on user request."""
+    def update_configuration(self, current_config: Dict, update_request: str) -> Tuple[Dict, concurrent.futures.Future]:
+        """Updates an existing configuration; the returned future resolves to the saved file path."""
         try:
             self.log(f"Processing update: {update_request}", "think")
 
             prompt = f"""
             Update this configuration:
-            {yaml.dump(current_config, default_flow_style=False)}
+            {yaml.dump(current_config, default_flow_style=False, Dumper=SafeDumper)}
 
             With these changes: {update_request}
 
             Knowledge base:
-            {yaml.dump(self.knowledge, default_flow_style=False)}
+            {self._knowledge_yaml}
 
             Requirements:
             - Maintain existing valid settings.
@@ -188,11 +440,10 @@ class ICLAgent:
             Response must be **pure YAML** with no extra text.
             """
             
-            response = self.model.generate_content(prompt)
-            updated_config = self._parse_yaml_safely(self._clean_response(response.text))
-            filepath = self._save_yaml(updated_config, "icl_config_updated")
+            updated_config, _ = self._finish(prompt, self._generate(prompt))
+            future = self._io_pool.submit(self._save_yaml, updated_config, "icl_config_updated")
 
-            return updated_config, filepath
+            return updated_config, future
         except Exception as e:
             self.log(f"Error updating configuration: {str(e)}", "error")
             raise
@@ -202,12 +453,12 @@ def icl_agent():
         agent = ICLAgent(doc_path="icl.pdf", api_key=os.getenv("GEMINI_API_KEY"))
 
         print("\n📝 Generating initial configuration...")
-        config, filepath = agent.process_request("Deploy a Node.js app with auto-scaling and 2GB RAM in a secured region")
-        print(f"\nConfiguration saved to: {filepath}")
+        config, saved = agent.process_request("Deploy a Node.js app with auto-scaling and 2GB RAM in a secured region")
+        print(f"\nConfiguration saved to: {saved.result()}")
 
         print("\n📝 Updating configuration...")
-        updated_config, updated_filepath = agent.update_configuration(config, "Increase CPU to 4 vCPUs and add GPU support")
-        print(f"\nUpdated configuration saved to: {updated_filepath}")
+        updated_config, updated_saved = agent.update_configuration(config, "Increase CPU to 4 vCPUs and add GPU support")
+        print(f"\nUpdated configuration saved to: {updated_saved.result()}")
     except Exception as e:
         print(f"\n❌ Fatal Error: {str(e)}")
         raise